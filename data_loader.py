@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Loading of the raw csv files, shared by the preprocessing and prediction scripts
+"""
+
+import os
+from functools import lru_cache
+from os.path import join as pj
+
+import pandas as pd
+import pyarrow as pa
+
+base_dir = os.path.dirname(__file__)
+data_dir = pj(base_dir, 'data')
+staging_dir = pj(base_dir, 'staging')
+os.makedirs(staging_dir, exist_ok=True)
+
+
+def read_data(name, parse_dates=None):
+    """Read `data/<name>.csv`, keeping an Arrow copy in `staging` for later runs.
+
+    The CSV is parsed with the multithreaded pyarrow engine and written back as an Arrow
+    IPC file, which is what gets loaded (memory mapped) as long as it is newer than the CSV.
+    """
+    csv_path = pj(data_dir, name + '.csv')
+    arrow_path = pj(staging_dir, name + '.arrow')
+    if os.path.exists(arrow_path) and os.path.getmtime(arrow_path) >= os.path.getmtime(csv_path):
+        table = pa.ipc.open_file(pa.memory_map(arrow_path)).read_all()
+        return table.to_pandas(self_destruct=True)
+
+    data = pd.read_csv(csv_path, engine='pyarrow', parse_dates=parse_dates)
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    with pa.OSFile(arrow_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return data
+
+
+# Each file is read once per process, whichever module asks for it first
+@lru_cache(maxsize=None)
+def get_active_days():
+    return read_data('active_days', parse_dates=['date'])
+
+
+@lru_cache(maxsize=None)
+def get_users():
+    return read_data('users')
+
+
+@lru_cache(maxsize=None)
+def get_cycles():
+    return read_data('cycles', parse_dates=['cycle_start'])
+
+
+@lru_cache(maxsize=None)
+def get_cycles_predict():
+    return read_data('cycles0', parse_dates=['cycle_start'])
+
+
+@lru_cache(maxsize=None)
+def get_tracking():
+    return read_data('tracking', parse_dates=['date'])
+
+
+@lru_cache(maxsize=None)
+def get_tracking_test():
+    return read_data('labels')
@@ -5,13 +5,12 @@
 Script used to predict with an already trained LSTM model
 """
 
-from os.path import join as pj
-
 import numpy as np
 import pandas as pd
 
+from data_loader import get_cycles_predict
 from model import get_model, get_weight_path
-from preprocessing import symptoms_of_interest_dict, data_dir, prepare_data_for_prediction
+from preprocessing import symptoms_of_interest, prepare_data_for_prediction
 
 # ====================== Default values ======================
 INPUT_SIZE = 16
@@ -117,28 +116,33 @@ def get_submission(model, sequence, cycles_predict,
         Tensor of 3 dimensions: user/sequence of days/symptoms
         Predicted n days (as per "days" parameter) of symptoms of all users
     """
-    # Create empty data frame that will contain result
-    submission = pd.DataFrame(columns=['user_id', 'day_in_cycle', 'symptom', 'probability'])
-
-    # Create a list of all unique expected cycles length
-    expected_lengths = list(set(cycles_predict.expected_cycle_length))
+    # Create empty list that will contain the result for each cycle length
+    formatted_submissions = []
 
-    # Loop through each unique expected cycle length and predict/format
-    for expected_length in expected_lengths:
+    # Loop through each unique expected cycle length and predict/format.
+    # A single groupby splits the users in one pass instead of scanning cycles_predict per length
+    for expected_length, women in cycles_predict.groupby('expected_cycle_length', sort=False).user_id:
         # Create user_id list of women with considered cycle length
-        women = list(cycles_predict[cycles_predict.expected_cycle_length == expected_length].user_id)
+        women = list(women)
         # Create symtoms subset for all considered women and reshape it
         women_to_predict = sequence.loc[women]
-        women_to_predict = women_to_predict.ix[:, :input_size]
+        women_to_predict = women_to_predict.iloc[:, :input_size]
         women_to_predict = np.array(women_to_predict).reshape(-1, maxlen, input_size)
         expected_length = int(np.ceil(expected_length))
         # Generate symptoms predictions
         res = generate_prediction(women_to_predict, model, maxlen=maxlen, input_size=input_size,
                                   output_size=output_size, days=expected_length)
         # Reshape symtoms predictions in the format expected by statice
-        formatted_submission = format_prediction(res.reshape(-1, 16), output_size, women, expected_length)
-        # Concatenate result for this cycle length with previous outputs for other cycle lengths
-        submission = pd.concat([submission, formatted_submission])
+        formatted_submissions.append(
+            format_prediction(res.reshape(-1, 16), output_size, women, expected_length)
+        )
+
+    # Concatenate results for all cycle lengths at once rather than growing the output on each loop
+    if formatted_submissions:
+        submission = pd.concat(formatted_submissions)
+    else:
+        # No user to predict for
+        submission = pd.DataFrame(columns=['user_id', 'day_in_cycle', 'symptom', 'probability'])
 
     return submission
 
@@ -174,7 +178,8 @@ def format_prediction(prediction,
     # Concatenate user_id and day_in_cycle
     s["index"] = day_in_cycle
     s.columns = ['day_in_cycle', 'symptom', 'probability']
-    s["symptom"] = s["symptom"].apply(lambda x: symptoms_of_interest_dict[x])
+    # Column positions are the symptom codes, decode them all at once as a categorical
+    s["symptom"] = pd.Categorical.from_codes(s["symptom"].astype(int), categories=symptoms_of_interest)
     output = pd.concat([user, s], axis=1)
 
     return output
@@ -210,7 +215,7 @@ if __name__ == '__main__':
     print("Created model and loaded weights from file")
 
     # Read user_id for which to make the prediction
-    cycles_predict = pd.read_csv(pj(data_dir, 'cycles0.csv'), parse_dates=['cycle_start'])
+    cycles_predict = get_cycles_predict()
 
     # Format input data so it can be read by the neural network
     X_predict = prepare_data_for_prediction(maxlen=args.maxlen)
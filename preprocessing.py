@@ -7,29 +7,14 @@ into the sequence of sequences required by RNNs.
 """
 
 import os
+from functools import lru_cache
 from os.path import join as pj
 
-import joblib
 import numpy as np
 import pandas as pd
+from numba import njit, prange
 
-base_dir = os.path.dirname(__file__)
-data_dir = pj(base_dir, 'data')
-staging_dir = pj(base_dir, 'staging')
-os.makedirs(staging_dir, exist_ok=True)
-
-# ====================== Import data ======================
-active_days = pd.read_csv(pj(data_dir, 'active_days.csv'), parse_dates=['date'])
-users = pd.read_csv(pj(data_dir, 'users.csv'))
-
-cycles = pd.read_csv(pj(data_dir, 'cycles.csv'), parse_dates=['cycle_start'])
-cycles_predict = pd.read_csv(pj(data_dir, 'cycles0.csv'), parse_dates=['cycle_start'])
-
-# Train on this
-tracking = pd.read_csv(pj(data_dir, 'tracking.csv'), parse_dates=['date'])
-# Test on this
-tracking_test = pd.read_csv(pj(data_dir, 'labels.csv'))
-
+from data_loader import staging_dir, get_users, get_cycles, get_tracking
 
 # =============  Symptoms on the correct order ============
 symptoms_of_interest = [
@@ -59,58 +44,66 @@ other_symptoms = [
     'ovulation_test_neg', 'ovulation_test_pos', 'pregnancy_test_neg', 'pregnancy_test_pos',  # test
 ]
 
-symptoms_of_interest_dict = {code: symptom for code, symptom in enumerate(symptoms_of_interest)}
 list_of_symptoms = symptoms_of_interest + other_symptoms
 training_columns = list_of_symptoms + ['day_in_cycle', 'absolute_day', 'period']
 
 
+# ====================== Import data ======================
+# Data is only read when first needed, so importing this module stays cheap
+@lru_cache(maxsize=None)
+def _tracking():
+    """Tracking data to train on, with symptoms as a categorical.
+
+    Categorical symptoms are compared and grouped as integer codes ordered after
+    `list_of_symptoms`.
+    """
+    tracking = get_tracking()
+    return tracking.assign(symptom=pd.Categorical(tracking.symptom, categories=list_of_symptoms))
+
+
 # ============  Feature engineer for the cycle ============
-def expand_cycle(cycle):
-    """Expand information about a given cycle for a given user.
+@njit(parallel=True, cache=True)
+def expand_cycle_days(cycle_length, period_length):
+    """Enumerate the days of all cycles.
 
     Parameters
     ----------
-    cycle : pd.Series
-        A single row from cycles.csv
+    cycle_length : np.array
+        Length in days of each cycle
+    period_length : np.array
+        Length in days of the period of each cycle
 
     Returns
     -------
-    expanded_cycle : pd.DataFrame
-        DataFrame with expanded information about the given cycle
-        - It has a pd.MultiIndex with the user_id and a date range spanning through
-          the days of the given cycle
-        - It has as columns the `cycle_id`, `day_in_cycle` and `period`. The last one
-          being a boolean indicating days of period.
+    cycle_index : np.array
+        Position in `cycle_length` of the cycle each day belongs to
+    day_in_cycle : np.array
+        Day in cycle, starting from 1 for every cycle
+    period : np.array
+        Boolean indicator of period days
     """
+    offsets = np.zeros(cycle_length.size + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(cycle_length)
 
-    # Get date range for the cycle
-    dates = pd.date_range(start=cycle.cycle_start, periods=cycle.cycle_length).tolist()
-    # Create a boolean indicator of period days
-    period = np.zeros(int(cycle.cycle_length), dtype=np.int8)
-    period[:int(cycle.period_length)] = 1
-    # Enumerate days in cycle
-    day_in_cycle = np.arange(1, int(cycle.cycle_length) + 1, dtype=np.int8)
-
-    # Build the index out of user_id and dates
-    index = pd.MultiIndex.from_tuples(
-        tuples=list(zip([cycle.user_id] * int(cycle.cycle_length), dates)),
-        names=["user_id", "date"]
-    )
+    cycle_index = np.empty(offsets[-1], dtype=np.int64)
+    day_in_cycle = np.empty(offsets[-1], dtype=np.int32)
+    period = np.zeros(offsets[-1], dtype=np.int8)
+    # Every cycle fills its own slice of the outputs, so cycles are processed in parallel
+    for i in prange(cycle_length.size):
+        for day in range(cycle_length[i]):
+            cycle_index[offsets[i] + day] = i
+            day_in_cycle[offsets[i] + day] = day + 1
+            if day < period_length[i]:
+                period[offsets[i] + day] = 1
 
-    # Build up the DataFrame
-    expanded_cycle = pd.DataFrame(
-        data=list(zip([cycle.cycle_id] * int(cycle.cycle_length), day_in_cycle, period)),
-        index=index,
-        columns=['cycle_id', 'day_in_cycle', 'period']
-    )
-
-    return expanded_cycle
+    return cycle_index, day_in_cycle, period
 
 
 def expand_cycles(cycles):
     """Expand all cycles for all users.
 
-    Simple iterator over exapnd_cycles. The output of this function has two purposes:
+    Every cycle is expanded into a row per calendar day, all at once with `expand_cycle_days`. The
+    output of this function has two purposes:
     - It brings period days as a feature to the final `features` DataFrame.
     - When merging it with tracking information, it adds up empty inactive days to the
       final `features` DataFrame.
@@ -124,15 +117,34 @@ def expand_cycles(cycles):
     -------
     cycles_processed : pd.DataFrame
         Complete daily details per user and cycle
+        - It has a pd.MultiIndex with the user_id and a date range spanning through
+          the days of each cycle, sorted by user_id and date
+        - It has as columns the `cycle_id`, `day_in_cycle` and `period`. The last one
+          being a boolean indicating days of period.
     """
 
-    cycles_processed_backup = pj(staging_dir, "cycles_processed.pkl.gz")
+    cycles_processed_backup = pj(staging_dir, "cycles_processed.parquet")
     # Try to load from memory if already computed
     if os.path.exists(cycles_processed_backup):
-        cycles_processed = joblib.load(cycles_processed_backup)
+        cycles_processed = pd.read_parquet(cycles_processed_backup).set_index(['user_id', 'date'])
     else:
-        cycles_processed = pd.concat([expand_cycle(cycle) for _, cycle in cycles.iterrows()])
-        joblib.dump(cycles_processed, cycles_processed_backup)
+        # Enumerate days in cycle and create a boolean indicator of period days
+        cycle_index, day_in_cycle, period = expand_cycle_days(
+            cycles.cycle_length.values.astype(np.int32),
+            cycles.period_length.values.astype(np.int32)
+        )
+        # Get date range for every cycle
+        dates = cycles.cycle_start.values[cycle_index] + (day_in_cycle - 1).astype('timedelta64[D]')
+
+        # Build up the DataFrame indexed by user_id and dates
+        cycles_processed = pd.DataFrame({
+            'user_id': cycles.user_id.values[cycle_index],
+            'date': dates,
+            'cycle_id': cycles.cycle_id.values[cycle_index],
+            'day_in_cycle': day_in_cycle.astype(np.int16),
+            'period': period,
+        }).set_index(['user_id', 'date']).sort_index()
+        cycles_processed.reset_index().to_parquet(cycles_processed_backup, compression='zstd')
 
     return cycles_processed
 
@@ -155,13 +167,18 @@ def process_tracking(tracking):
           `list_of_symptoms`
 
     """
-    tracking_processed = pd.get_dummies(
-        tracking[["user_id", "date", "symptom"]],
-        columns=['symptom'], prefix='', prefix_sep=''
-    )
+    # Number each (user_id, date) group, symptoms are already encoded after `list_of_symptoms`
+    grouped = tracking.groupby(['user_id', 'date'])
+    keys = grouped.ngroup().to_numpy()
+    codes = tracking.symptom.cat.codes.values
+    # Rows with a missing user_id or date belong to no group and are left out, as are unknown symptoms
+    known = (codes >= 0) & ~np.isnan(keys)
 
-    # Aggregate symptoms per day
-    return tracking_processed.groupby(['user_id', 'date']).sum()[list_of_symptoms]
+    # Aggregate symptoms per day by scattering them straight into the one hot matrix
+    tracking_processed = np.zeros((grouped.ngroups, len(list_of_symptoms)), dtype=np.int8)
+    np.add.at(tracking_processed, (keys[known].astype(np.int64), codes[known]), 1)
+
+    return pd.DataFrame(tracking_processed, index=grouped.size().index, columns=list_of_symptoms)
 
 
 # ===============  Merging all the features ===============
@@ -193,52 +210,64 @@ def get_features(split=True, force=False):
           until the end of her last period.
         - The first 81 columns are booleans indicating if the user had a given symptom on
           a given day. The ordering of the symptoms goes according to `list_of_symptoms`.
-          The last 3 columns correspond to `cycle_id`, `day_in_cycle` and `period`. `period`
-          is a boolean indicating if the user had her period that day.
-        - Inactive days also get a row on this DataFrame for which symptoms are filled with
-          zeros and `cycle_id`, `day_in_cycle` and `period` are properly backfilled from the
-          information in cycles.
+          The last 3 columns correspond to `day_in_cycle`, `absolute_day` and `period`.
+          `period` is a boolean indicating if the user had her period that day.
+        - Rows are the days of the expanded cycles, and tracked symptoms are aligned on them.
+          Inactive days also get a row on this DataFrame for which symptoms are filled with
+          zeros and `day_in_cycle` and `period` are properly backfilled from the information
+          in cycles. Tracked days that fall outside every cycle are dropped.
+        - Symptoms and `period` are stored as int8, `day_in_cycle` as int16 (cycles can
+          be longer than 127 days) and `absolute_day` as int32 to keep the DataFrame small.
     """
 
-    features_backup = pj(staging_dir, 'features.pkl.gz')
+    # The int8 columns are backed up as a raw numpy array that can be memory mapped,
+    # the index, `day_in_cycle` and `absolute_day` go to a parquet sidecar
+    int8_columns = list_of_symptoms + ['period']
+    features_backup = pj(staging_dir, 'features.npy')
+    features_index_backup = pj(staging_dir, 'features_index.parquet')
 
     # Try to load from memory if already computed
-    if os.path.exists(features_backup) and not force:
-        features = joblib.load(features_backup)
+    if os.path.exists(features_backup) and os.path.exists(features_index_backup) and not force:
+        features_index = pd.read_parquet(features_index_backup)
+        features = pd.DataFrame(
+            np.load(features_backup, mmap_mode='r'),
+            index=pd.MultiIndex.from_frame(features_index[['user_id', 'date']]),
+            columns=int8_columns,
+            copy=False
+        )
+        features['day_in_cycle'] = features_index.day_in_cycle.values
+        features['absolute_day'] = features_index.absolute_day.values
+        features = features[training_columns]
     else:
         # Expand cycles so that there is a line per date (active or not) with a boolean indicator of period
-        cycles_processed = expand_cycles(cycles)
+        cycles_processed = expand_cycles(get_cycles())
 
         # Expand tracking so that there is a line per date (active or not) with a one hot encoded symtoms
-        tracking_processed = process_tracking(tracking)
-
-        # Merge cycles and tracking information
-        features = pd.merge(
-            tracking_processed,
-            cycles_processed,
-            left_index=True, right_index=True, how='outer'
-        ).fillna(0)
+        tracking_processed = process_tracking(_tracking())
 
         # Find the first day the user started using the app
-        features = pd.merge(
-            features,
-            cycles.groupby('user_id')\
-                  .agg({'cycle_start': {'first_use': 'min'}})\
-                  .reset_index()\
-                  .set_index('user_id')['cycle_start'],
-            left_index=True,
-            right_index=True
-        )
+        first_use = get_cycles().groupby('user_id', sort=False)['cycle_start'].min().rename('first_use')
+
+        # Merge cycles, tracking and first use information in a single chain. cycles_processed
+        # already holds every day (active or not), so tracking is aligned on it and inactive
+        # days get zero symptoms. Rows then line up by position with cycles_processed, even for
+        # dates repeated by overlapping cycles
+        features = tracking_processed.reindex(cycles_processed.index, fill_value=0)\
+                                     .assign(day_in_cycle=cycles_processed.day_in_cycle.values,
+                                             period=cycles_processed.period.values)\
+                                     .join(first_use, on='user_id')
 
         # Find the absolute day for each row from the day the user started using the app
-        absolute_day = (features.reset_index().date.dt.date - features.reset_index().first_use.dt.date).dt.days + 1
-        absolute_day.index = features.index
-        features['absolute_day'] = absolute_day
+        dates = features.index.get_level_values('date').values.astype('datetime64[D]')
+        absolute_day = dates - features.first_use.values.astype('datetime64[D]')
+        features['absolute_day'] = absolute_day.astype(np.int32) + 1
         # Keep only the columns needed by the RNN
         features = features[training_columns]
 
         # Make a copy to speed up development iterations
-        joblib.dump(features, features_backup)
+        np.save(features_backup, features[int8_columns].values)
+        features.reset_index()[['user_id', 'date', 'day_in_cycle', 'absolute_day']]\
+                .to_parquet(features_index_backup, compression='zstd')
 
         # This saves memory, I think...
         del tracking_processed
@@ -246,10 +275,13 @@ def get_features(split=True, force=False):
 
     if split:
         # Do a train/test split of the data
-        train_users = users.user_id.sample(frac=0.8)
-        features = features.reset_index()
-        df_train = features[features.user_id.isin(train_users)][training_columns]
-        df_test = features[~features.user_id.isin(train_users)][training_columns]
+        users = get_users()
+        rng = np.random.default_rng()
+        train_users = rng.choice(users.user_id.values, size=int(0.8 * len(users)), replace=False)
+        # Build the mask of training rows once and use it for both sides of the split
+        is_train = np.isin(features.index.get_level_values('user_id').values, train_users)
+        df_train = features[is_train]
+        df_test = features[~is_train]
         return df_train, df_test
     else:
         return features
@@ -280,34 +312,20 @@ def prepare_data_for_prediction(features=None, maxlen=90):
 
     """
 
-    def get_user_daterange_index(user_id, max_date, length):
-        """Return a list of tuples with [user_id] x list of 'length' last days.
-
-        The list of tuples will be used to reconstruct an index with only the
-        the previous `length` dates per user starting from 'max_date' backwards.
-        """
-        dates = pd.date_range(end=max_date, periods=length)
-        return list(zip([user_id] * len(dates), dates))
-
     if features is None:
         features = get_features(split=False)
 
     # Look up for the last day of activity per user
-    cycles_processed = expand_cycles(cycles)
-    day_maxs = cycles_processed.reset_index() \
-        .groupby("user_id") \
-        .agg({
-        'date': {'max_date': 'max'}
-    })['date']
-
-    # Get dates for all users
-    index_tuples = []
-    for user_id, max_date in day_maxs.iterrows():
-        index_tuples.extend(get_user_daterange_index(user_id, max_date.iloc[0], maxlen))
+    cycles_processed = expand_cycles(get_cycles())
+    day_maxs = cycles_processed.reset_index().groupby('user_id')['date'].max()
+
+    # Get the `maxlen` last dates for all users, from `max_date` backwards
+    offsets = np.arange(-(maxlen - 1), 1).astype('timedelta64[D]')
+    dates = (day_maxs.values[:, None] + offsets[None, :]).ravel()
 
     # Construct the index with the last dates per user
-    index = pd.MultiIndex.from_tuples(
-        tuples=index_tuples,
+    index = pd.MultiIndex.from_arrays(
+        arrays=[np.repeat(day_maxs.index.values, maxlen), dates],
         names=["user_id", "date"]
     )
 
@@ -8,7 +8,6 @@ Script used to train the LSTM model
 import joblib
 import numpy as np
 from keras.callbacks import ModelCheckpoint
-from keras.optimizers import adam
 
 from model import get_model, get_weight_path
 
@@ -64,8 +63,9 @@ def reformat(df_in,
     # Container for the ys
     next_day = np.empty((max_sequences, output_size), dtype=int)
     # The sequence of absolute days which we wil use to tell one user from another
-    days = df_in.loc[:, "absolute_day"].reset_index(drop=True)
-    df = df_in.reset_index(drop=True)
+    days = df_in.loc[:, "absolute_day"].values
+    # Plain arrays avoid the pandas indexing overhead on each step of the loop
+    df = df_in.values
 
     # Counter for the number of sequences created
     j = 0
@@ -78,17 +78,17 @@ def reformat(df_in,
     while (day_i < (df.shape[0] - maxlen)) & (j < max_sequences):
         # Ensure that the beginning and end of the sequence correspond to the same user
         #   i.e. the last_day is anterior to current dat
-        if last_day < days.ix[day_i + maxlen]:
+        if last_day < days[day_i + maxlen]:
             # Store the Xs
-            days_sequence[j] = df.ix[day_i: day_i + maxlen - 1, :input_size]
+            days_sequence[j] = df[day_i: day_i + maxlen, :input_size]
             # Store the y
-            next_day[j] = df.ix[day_i + maxlen, :output_size]
+            next_day[j] = df[day_i + maxlen, :output_size]
             # Increment sequence counter
             j += 1
         # move along the raw input by step_days
         day_i += step_days
         # Update counters
-        last_day = days.ix[day_i]
+        last_day = days[day_i]
 
 
     # In case less sequence than the max have been created, shorted the outputs
@@ -147,7 +147,7 @@ if __name__ == '__main__':
     del df_test
 
     model = get_model(args.model, args.input_size, args.output_size, args.maxlen)
-    model.compile(loss='binary_crossentropy', optimizer=adam(), metrics=['accuracy'])
+    model.compile(loss='binary_crossentropy', optimizer='adam', metrics=['accuracy'])
 
     # Define callback to save model
     save_snapshots = ModelCheckpoint(weights_backup,
@@ -160,7 +160,7 @@ if __name__ == '__main__':
     train_history = model.fit(X_train,
                               y_train,
                               batch_size=args.batch_size,
-                              nb_epoch=args.N_epochs,
+                              epochs=args.N_epochs,
                               validation_data=(X_test, y_test),
                               callbacks=[save_snapshots],
                               verbose=1)